@@ -1,11 +1,15 @@
 # Import native libraries
-from collections import defaultdict
 import logging
 import json
+import sys
 import os
 
 # Import third-party libraries
+import pyarrow.csv as pacsv
+import pyarrow as pa
+import numpy as np
 import pandas as pd
+import orjson
 
 
 # Set constant values for the script, enforcing them with a class
@@ -34,14 +38,13 @@ def setup_logging():
 
 def ingest_data(directory_path):
     """
-    Ingests the filtered triples for building the knowledge graph.
+    Ingests the filtered triples for building the knowledge graph. Records are yielded one at a
+    time so the full set of triples never has to be held in memory.
 
     :param directory_path: Path to the input data files.
-    :return merged_input_data: All input data merged into a list of dictionaries.
+    :yield: Each input record as a dictionary.
     """
 
-    merged_input_data = []
-
     # Loop through all files in the directory
     for filename in os.listdir(directory_path):
 
@@ -51,29 +54,39 @@ def ingest_data(directory_path):
             # Construct the full filepath
             file_path = os.path.join(directory_path, filename)
 
-            # Open the individual file
-            with open(file_path, "r", encoding="utf-8") as f:
+            # Read the individual file in a single call
+            with open(file_path, "rb") as f:
+
+                raw_data = f.read()
+
+            # Parse each line as a JSON object
+            for line in raw_data.splitlines():
 
-                # Parse each line as a JSON object
-                for line in f:
+                # Remove potential space
+                line = line.strip()
 
-                    # Remove potential space
-                    line = line.strip()
+                # Skip empty lines
+                if line:
 
-                    # Skip empty lines
-                    if line:
+                    try:
 
-                        try:
+                        # Parse the data
+                        record = orjson.loads(line)
 
-                            # Parse and append the data
-                            merged_input_data.append(json.loads(line))
+                    except orjson.JSONDecodeError as e:
 
-                        except json.JSONDecodeError as e:
+                        logging.error("Error parsing line in %s: %s", filename, e)
+                        logging.error("Json line: %s", line)
 
-                            logging.error("Error parsing line in %s: %s", filename, e)
-                            logging.error("Json line: %s", line)
+                        continue
 
-    return merged_input_data
+                    # Intern the entity names, they repeat heavily across triples so every
+                    # occurrence can share one string object. This only saves memory while the
+                    # records are collected, pandas copies the values into its own string storage
+                    record["linked_head"] = sys.intern(record["linked_head"])
+                    record["linked_tail"] = sys.intern(record["linked_tail"])
+
+                    yield record
 
 
 def output_data(data, output_dir, filename):
@@ -113,36 +126,32 @@ def generate_raw_edge_counts(kg_nodes_edges):
     Counts unique pairs of linked_head and linked_tail (both directions) and returns a
     list of dictionaries with head, tail, and raw_edge_weight.
 
-    :param kg_nodes_edges: A list of nodes and edges.
+    :param kg_nodes_edges: An iterable of nodes and edges.
     :return distinct_kg_nodes_edges: A list of dictionaries containing the distinct counts of
     triples.
     """
 
-    # Generate an object to store the data
-    edge_counts = defaultdict(int)
-
-    # Enumerate over the data
-    for row in kg_nodes_edges:
+    # Load only the head and tail values into a DataFrame
+    edges_df = pd.DataFrame(
+        [(row["linked_head"], row["linked_tail"]) for row in kg_nodes_edges],
+        columns=["linked_head", "linked_tail"]
+    )
 
-        # Extract the head and tail values
-        h = row["linked_head"]
-        t = row["linked_tail"]
+    # Ignore cases where a node is related to itself
+    edges_df = edges_df[edges_df["linked_head"] != edges_df["linked_tail"]]
 
-        # Ignore cases where a node is related to itself
-        if h == t:
-            continue
+    # Extract the head and tail values
+    heads = edges_df["linked_head"].to_numpy(dtype=object)
+    tails = edges_df["linked_tail"].to_numpy(dtype=object)
 
-        # Sort the pair so (A, B) and (B, A) are treated identically
-        key = tuple(sorted([h, t]))
+    # Order each pair so (A, B) and (B, A) are treated identically
+    pairs_df = pd.DataFrame({"head": np.minimum(heads, tails), "tail": np.maximum(heads, tails)})
 
-        # Increase the count for this node pair
-        edge_counts[key] += 1
+    # Count the occurrences of each node pair
+    edge_counts = pairs_df.groupby(["head", "tail"]).size().reset_index(name="raw_edge_weight")
 
     # Convert counts to list of dictionaries
-    distinct_kg_nodes_edges = [
-        {"head": k[0], "tail": k[1], "raw_edge_weight": v}
-        for k, v in edge_counts.items()
-    ]
+    distinct_kg_nodes_edges = edge_counts.to_dict("records")
 
     return distinct_kg_nodes_edges
 
@@ -161,79 +170,79 @@ def normalize_edges(kg_data_raw_edge_counts, renormalization_threshold):
     weight normalized between 0 and 1.
     """
 
-    # Protect input from mutation
-    kg_data_raw_edge_counts = [e.copy() for e in kg_data_raw_edge_counts]
-
-    # Extract raw weights
-    raw_weights = [e['raw_edge_weight'] for e in kg_data_raw_edge_counts]
+    # Extract raw weights into a single array
+    raw_weights = np.fromiter(
+        (e["raw_edge_weight"] for e in kg_data_raw_edge_counts),
+        dtype=np.float64,
+        count=len(kg_data_raw_edge_counts)
+    )
 
     # Conduct initial normalization
-    min_w = min(raw_weights)
-    max_w = max(raw_weights)
+    min_w = raw_weights.min()
+    max_w = raw_weights.max()
 
     # Handle cases where all values are equal
     if max_w == min_w:
 
-        normalized_weights = [1.0 for _ in raw_weights]
+        normalized_weights = np.ones_like(raw_weights)
 
     # Handle cases where all values are not equal
     else:
 
-        normalized_weights = [(w - min_w) / (max_w - min_w) for w in raw_weights]
-
-    # Attach normalized weight temporarily
-    for e, nw in zip(kg_data_raw_edge_counts, normalized_weights):
+        normalized_weights = (raw_weights - min_w) / (max_w - min_w)
 
-        e['_normalized'] = nw
+    # Keep every edge by default
+    kept_indices = np.arange(len(normalized_weights))
 
     # Remove bottom X percent based on the threshold
     if renormalization_threshold > 0:
 
-        threshold = (
-            sorted(normalized_weights)[
-                int(len(normalized_weights) * renormalization_threshold / 100)
-                ]
-            )
+        # Select the cutoff value with a partial sort, equivalent to indexing the sorted weights
+        cutoff_index = int(len(normalized_weights) * renormalization_threshold / 100)
+        threshold = np.partition(normalized_weights, cutoff_index)[cutoff_index]
 
-        kg_data_raw_edge_counts = (
-            [e for e in kg_data_raw_edge_counts if e['_normalized'] > threshold]
-            )
+        kept_indices = np.flatnonzero(normalized_weights > threshold)
 
-    # Renormalize the remaining edges
-    if kg_data_raw_edge_counts:
+    nw_remaining = normalized_weights[kept_indices]
 
-        nw_remaining = [e['_normalized'] for e in kg_data_raw_edge_counts]
+    # Renormalize the remaining edges
+    if len(nw_remaining) > 0:
 
-        min_r = min(nw_remaining)
-        max_r = max(nw_remaining)
+        min_r = nw_remaining.min()
+        max_r = nw_remaining.max()
 
         # Handle cases where all values are equal
         if max_r == min_r:
 
-            renormalized = [1.0 for _ in nw_remaining]
+            renormalized = np.ones_like(nw_remaining)
 
         # Handle cases where all values are not equal
         else:
 
-            renormalized = [(w - min_r) / (max_r - min_r) for w in nw_remaining]
-
-        # Replace key
-        for e, ew in zip(kg_data_raw_edge_counts, renormalized):
+            renormalized = (nw_remaining - min_r) / (max_r - min_r)
 
-            e['edge weight'] = ew
-            del e['_normalized']
-            del e['raw_edge_weight']
+    else:
 
-    # Log final graph stats
-    num_edges = len(kg_data_raw_edge_counts)
+        renormalized = nw_remaining
 
+    # Build the output edges with the renormalized weight, collecting the distinct nodes in the
+    # same pass for the final graph stats
+    renormalized_edges = []
     nodes = set()
 
-    for e in kg_data_raw_edge_counts:
+    for i, ew in zip(kept_indices.tolist(), renormalized.tolist()):
+
+        edge = kg_data_raw_edge_counts[i]
+
+        renormalized_edges.append({"head": edge["head"], "tail": edge["tail"], "edge weight": ew})
+
+        nodes.add(edge["head"])
+        nodes.add(edge["tail"])
 
-        nodes.add(e['head'])
-        nodes.add(e['tail'])
+    kg_data_raw_edge_counts = renormalized_edges
 
+    # Log final graph stats
+    num_edges = len(kg_data_raw_edge_counts)
     num_nodes = len(nodes)
 
     logging.info("After renormalization: %s nodes, %s edges", num_nodes, num_edges)
@@ -255,44 +264,35 @@ def export_gephi_csv(edge_data, output_dir, basename):
 
         os.makedirs(output_dir)
 
-    # Build edges DataFrame
-    edges_df = pd.DataFrame(edge_data)
-
-    edges_df = edges_df.rename(
-        columns={
-            "head": "Source",
-            "tail": "Target",
-            "edge weight": "Weight"
+    # Build the edges table directly from the edge data
+    edges_table = pa.table(
+        {
+            "Source": pa.array([e["head"] for e in edge_data], type=pa.string()),
+            "Target": pa.array([e["tail"] for e in edge_data], type=pa.string()),
+            "Weight": pa.array([e["edge weight"] for e in edge_data], type=pa.float64()),
+            "Type": pa.array(["Undirected"] * len(edge_data), type=pa.string())
         }
     )
 
-    edges_df["Source"] = edges_df["Source"].astype(str)
-    edges_df["Target"] = edges_df["Target"].astype(str)
-    edges_df["Weight"] = edges_df["Weight"].astype(float)
-    edges_df["Type"] = "Undirected"
-
     # Write the file containing the graph edges as a CSV
     edges_path = os.path.join(output_dir, f"{basename}_edges.csv")
-    edges_df.to_csv(edges_path, index=False, encoding="utf-8")
+    pacsv.write_csv(edges_table, edges_path)
 
     logging.info("Gephi edges CSV written to %s", edges_path)
 
-    # Build nodes DataFrame
-    nodes = set(edges_df["Source"]).union(edges_df["Target"])
+    # Build nodes table from the distinct sources and targets without leaving Arrow
+    nodes = pa.chunked_array(edges_table["Source"].chunks + edges_table["Target"].chunks).unique()
 
-    nodes_df = pd.DataFrame(
+    nodes_table = pa.table(
         {
-            "Id": list(nodes),
-            "Label": list(nodes)
+            "Id": nodes,
+            "Label": nodes
         }
     )
 
-    nodes_df["Id"] = nodes_df["Id"].astype(str)
-    nodes_df["Label"] = nodes_df["Label"].astype(str)
-
     # Write the file containing the graph nodes as a CSV
     nodes_path = os.path.join(output_dir, f"{basename}_nodes.csv")
-    nodes_df.to_csv(nodes_path, index=False, encoding="utf-8")
+    pacsv.write_csv(nodes_table, nodes_path)
 
     logging.info("Gephi nodes CSV written to %s", nodes_path)
 
@@ -311,7 +311,7 @@ if __name__ == "__main__":
 
     logging.info("Ingesting source data...")
 
-    # Ingest the data
+    # Ingest the data lazily, the triples are consumed as they are aggregated
     raw_kg_triples = ingest_data(directory_path=config["input_directory"])
 
     logging.info("Aggregating raw edge counts...")
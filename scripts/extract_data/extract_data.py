@@ -1,9 +1,13 @@
 # Import third-party libraries
 import zstandard
+import orjson
 
 # Import native libraries
-from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
 import logging.handlers
+import threading
+import time
+import queue
 import json
 import os
 
@@ -13,91 +17,123 @@ log.setLevel(logging.INFO)
 log.addHandler(logging.StreamHandler())
 
 
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
+# Set constant values for the script, enforcing them with a class
+class Constants:
     """
-    Reads a chunk of data from a reader, attempts to decode it to a string, and recursively tries 
-    to read more data if a Unicode decoding error occurs. This handles files that may have incomplete 
-    UTF-8 sequences at chunk boundaries.
-    
-    :param reader: The reader object from which data is read.
-    :param chunk_size: Number of bytes to read per chunk.
-    :param max_window_size: Maximum number of bytes to attempt reading in case of decoding error.
-    :param previous_chunk: The previous chunk of data to append in case of error (for recursive reads).
-    :param bytes_read: Counter for the total number of bytes read.
-    :return: The decoded chunk of data as a string.
+    A class specifically for enforcing constant values in the script.
     """
-    
-    # Read a chunk of the file
-    chunk = reader.read(chunk_size)
 
-    # Increment the total bytes read
-    bytes_read += chunk_size
+    REDDIT_URL_PREFIX = "https://www.reddit.com/"
+    READ_CHUNK_SIZE = 2**22
+    CHUNK_QUEUE_SIZE = 8
+    WRITE_BATCH_SIZE = 1000
+    WRITE_BUFFER_SIZE = 2**20
 
-    # Append the previous chunk to next chunk
-    if previous_chunk is not None:
 
-        chunk = previous_chunk + chunk
+def decompress_chunks(file_name, chunk_queue):
+    """
+    Decompresses a Zstandard-compressed file on a background thread, putting each chunk of raw
+    bytes on a queue along with the current byte offset. The decompressor releases the GIL, so
+    this overlaps with the JSON parsing on the main thread. A None sentinel marks the end of the
+    file, and any error is put on the queue so that the consumer can raise it.
+
+    :param file_name: Path to the Zstandard-compressed file.
+    :param chunk_queue: The bounded queue to put the decompressed chunks on.
+    """
 
     try:
 
-        # Attempt to decode the chunk to a UTF-8 string
-        return chunk.decode()
-    
-    except UnicodeDecodeError:
+        # Open the compressed file in binary mode
+        with open(file_name, 'rb') as file_handle:
 
-        # If decoding fails and max window size exceeded, raise an error
-        if bytes_read > max_window_size:
+            # The file is read strictly front to back, let the kernel read ahead aggressively
+            if hasattr(os, "posix_fadvise"):
 
-            raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
+                os.posix_fadvise(file_handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
 
-        # Log the decoding error and continue reading
-        log.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-        
-        # Recursively attempt to decode with additional data
-        return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+            # Set up a Zstandard decompression reader with max window size, reading the compressed
+            # input in the same chunk size that is decompressed per iteration
+            reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(
+                file_handle,
+                read_size=Constants.READ_CHUNK_SIZE
+            )
+
+            while True:
+
+                # Read a cache-sized chunk of raw bytes from the compressed file
+                chunk = reader.read(Constants.READ_CHUNK_SIZE)
+
+                # Exit the loop if no more data is returned
+                if not chunk:
+
+                    break
+
+                # Hand the chunk and current byte offset in file to the consumer
+                chunk_queue.put((chunk, file_handle.tell()))
+
+            # Drop the file from the page cache so large archives don't evict each other
+            if hasattr(os, "posix_fadvise"):
+
+                os.posix_fadvise(file_handle.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+            # Close the decompression reader
+            reader.close()
+
+    except Exception as e:
+
+        # Pass the error to the consumer so it is raised on the main thread
+        chunk_queue.put(e)
+
+    # Signal that there is no more data
+    chunk_queue.put(None)
 
 
 def read_lines_zst(file_name):
     """
-    Reads lines from a Zstandard-compressed file, yielding each line individually.
+    Reads lines from a Zstandard-compressed file, yielding each line individually. Lines are kept
+    as raw bytes, splitting on the newline byte is safe for UTF-8 since no multi-byte sequence can
+    contain 0x0A. Decompression runs on a background thread that stays a few chunks ahead.
     
     :param file_name: Path to the Zstandard-compressed file.
-    :yield: Each line from the decompressed file along with the current byte offset.
+    :yield: Each line from the decompressed file as bytes along with the current byte offset.
     """
-    
-    # Open the compressed file in binary mode
-    with open(file_name, 'rb') as file_handle:
-        
-        # Initialize a buffer to store partial lines between reads
-        buffer = ''
-        
-        # Set up a Zstandard decompression reader with max window size
-        reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
 
-        while True:
+    # Start decompressing into a bounded queue so memory use stays capped
+    chunk_queue = queue.Queue(maxsize=Constants.CHUNK_QUEUE_SIZE)
 
-            # Read and decode a large chunk from the compressed file
-            chunk = read_and_decode(reader, 2**27, (2**29) * 2)
+    threading.Thread(target=decompress_chunks, args=(file_name, chunk_queue), daemon=True).start()
 
-            # Exit the loop if no more data is returned
-            if not chunk:
+    # Initialize a buffer to store partial lines between reads
+    buffer = b''
 
-                break
+    while True:
 
-            # Combine buffer and chunk, then split on newline to separate lines
-            lines = (buffer + chunk).split("\n")
+        # Wait for the next decompressed chunk
+        item = chunk_queue.get()
 
-            # Yield each line except the last incomplete line
-            for line in lines[:-1]:
+        # Exit the loop once the producer signals the end of the file
+        if item is None:
 
-                # Yield line and current byte offset in file
-                yield line, file_handle.tell()
-            
-            # Save the last partial line for the next iteration
-            buffer = lines[-1]
+            break
+
+        # Raise any error hit while decompressing
+        if isinstance(item, Exception):
+
+            raise item
+
+        chunk, file_bytes_processed = item
 
-        # Close the decompression reader
-        reader.close()
+        # Combine buffer and chunk, then split on newline to separate lines
+        lines = (buffer + chunk).split(b"\n")
+
+        # Yield each line except the last incomplete line
+        for line in lines[:-1]:
+
+            # Yield line and current byte offset in file
+            yield line, file_bytes_processed
+
+        # Save the last partial line for the next iteration
+        buffer = lines[-1]
 
 
 def process_file(raw_data_filepath, extraction_keys):
@@ -114,7 +150,7 @@ def process_file(raw_data_filepath, extraction_keys):
     # Initialize counters and placeholders
     file_lines = 0                # Total lines processed
     file_bytes_processed = 0      # Bytes processed so far
-    created = None                # Timestamp for progress tracking
+    created_ts = None             # Raw 'created_utc' timestamp for progress tracking
     bad_lines = 0                 # Count of malformed or missing JSON lines
 
     # Split the path into components
@@ -129,8 +165,20 @@ def process_file(raw_data_filepath, extraction_keys):
     # Construct the new file path
     jsonl_output_file = os.path.join(new_directory, new_filename)
 
-    # Open output file in write mode
-    with open(jsonl_output_file, 'w', encoding='utf-8') as output_file:
+    # Extract the original key and new key from each dictionary in the config once per file
+    field_pairs = [next(iter(mapping.items())) for mapping in extraction_keys]
+
+    # Find the output key the permalink is mapped to, if it is extracted for this file
+    permalink_key = next(
+        (new_key for original_key, new_key in field_pairs if original_key == "permalink"),
+        None
+    )
+
+    # Use a list to accumulate serialized records for batch writing
+    output_lines = []
+
+    # Open output file in binary write mode, orjson serializes straight to bytes
+    with open(jsonl_output_file, 'wb', buffering=Constants.WRITE_BUFFER_SIZE) as output_file:
         
         # Read lines from the Zstandard-compressed file
         for line, file_bytes_processed in read_lines_zst(raw_data_filepath):
@@ -138,36 +186,24 @@ def process_file(raw_data_filepath, extraction_keys):
             try:
 
                 # Attempt to parse each line as JSON
-                obj = json.loads(line)
-
-                # Create an empty dictionary to store the information we need
-                record = {}
+                obj = orjson.loads(line)
 
-                # Enumerate through the list of dictionaries in the config file
-                for mapping in extraction_keys:
+                # Build a dictionary with the new key names (e.g. instead of "ups" we want "upvotes")
+                # The .get function will handle empty and null strings
+                record = {new_key: obj.get(original_key) for original_key, new_key in field_pairs}
 
-                    # Extract the original key and new key from each dictionary
-                    original_key, new_key = next(iter(mapping.items()))
+                # Handle special case for the 'permalink' key by building the full post URL
+                if permalink_key and record[permalink_key]:
 
-                    # Extract the value using the key name in the raw data file
-                    value = obj.get(original_key, None)  # The .get function will handle empty and null strings
-
-                    # Handle special case for the 'permalink' key
-                    if original_key == "permalink" and value:
-
-                        # Build the full post URL
-                        value = "https://www.reddit.com/" + str(value)
-                    
-                    # Add the key to the dictionary with the new names (e.g. instead of "ups" we want "upvotes")
-                    record[new_key] = value
+                    record[permalink_key] = Constants.REDDIT_URL_PREFIX + record[permalink_key]
                 
-                # Write the dictionary to the JSONL file as a JSON string
-                output_file.write(json.dumps(record) + '\n')
+                # Add the dictionary to the batch as a JSON line
+                output_lines.append(orjson.dumps(record))
                 
-                # Convert 'created_utc' to a UTC-aware datetime object for progress tracking
-                created = datetime.fromtimestamp(int(obj['created_utc']), tz=timezone.utc)
+                # Keep the raw 'created_utc' value, it is only converted when progress is logged
+                created_ts = obj['created_utc']
             
-            except (KeyError, json.JSONDecodeError):
+            except (KeyError, orjson.JSONDecodeError):
 
                 # Increment count of malformed lines
                 bad_lines += 1
@@ -175,13 +211,58 @@ def process_file(raw_data_filepath, extraction_keys):
             # Increment the line counter
             file_lines += 1
 
-            # Log progress every 100,000 lines processed
-            if file_lines % 100000 == 0:
-                log.info(f"{created.strftime('%Y-%m-%d %H:%M:%S')} : {file_lines:,} : {bad_lines:,} : {file_bytes_processed:,}:{(file_bytes_processed / file_size) * 100:.0f}%")
+            # Batch write to the output file for efficiency
+            if len(output_lines) >= Constants.WRITE_BATCH_SIZE:
+
+                # Write the lines to the output file
+                output_file.write(b'\n'.join(output_lines) + b'\n')
+
+                # Reset the batch list
+                output_lines.clear()
+
+            # Log progress every 100,000 lines processed, skipping the work if INFO is disabled
+            if file_lines % 100000 == 0 and log.isEnabledFor(logging.INFO):
+
+                # Convert the timestamp to a UTC time string for progress tracking
+                created = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(created_ts)))
+
+                log.info(
+                    "%s : %d : %d : %d:%.0f%%",
+                    created,
+                    file_lines,
+                    bad_lines,
+                    file_bytes_processed,
+                    (file_bytes_processed / file_size) * 100
+                )
+
+        # After finishing the loop, write any remaining lines
+        if output_lines:
+
+            # Write the lines to the output file
+            output_file.write(b'\n'.join(output_lines) + b'\n')
 
     # Log final completion statistics
-    log.info(f"Complete : {file_lines:,} : {bad_lines:,}")
-    log.info(f"Data has been written to {jsonl_output_file}")
+    log.info("Complete : %d : %d", file_lines, bad_lines)
+    log.info("Data has been written to %s", jsonl_output_file)
+
+
+def process_config_entry(config_entry):
+    """
+    Processes a single file from the config file. Used as the unit of work for the process pool,
+    so it has to stay a module-level function that can be pickled.
+
+    :param config_entry: A tuple of the config key and its values (path and extraction keys).
+    """
+
+    key, value = config_entry
+
+    log.info("Processing %s data...", key)
+
+    # Extract the filepath and the values we want to extract from the raw files
+    raw_data_filepath = value["path"]
+    extraction_keys = value["values"]
+
+    process_file(raw_data_filepath, extraction_keys)
 
 
 if __name__ == "__main__":
@@ -196,15 +277,12 @@ if __name__ == "__main__":
         # Read the data into a dictionary
         config = json.load(file)
 
-    # Enumerate over the top-level keys and values in the config file
-    for key, value in config.items():
-
-        log.info(f"Processing {key} data...")
+    # Each file is independent and CPU-bound, so run one worker process per file
+    max_workers = min(len(config), os.cpu_count() or 1)
 
-        # Extract the filepath and the values we want to extract from the raw files
-        raw_data_filepath = value["path"]
-        extraction_keys = value["values"]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
 
-        process_file(raw_data_filepath, extraction_keys)
+        # Consume the results so an exception raised in a worker is re-raised here
+        list(executor.map(process_config_entry, config.items()))
 
     log.info("All files have been processed.")
@@ -1,12 +1,19 @@
 # Import native libraries
+from collections import OrderedDict
 import logging
+import asyncio
+import sqlite3
+import signal
+import atexit
 import json
+import time
 import sys
 import os
 
 # Import third-party libraries
-from fuzzywuzzy import fuzz
-import requests
+from rapidfuzz import fuzz, process
+import aiohttp
+import orjson
 
 
 # Set constant values for the script, enforcing them with a class
@@ -17,6 +24,25 @@ class Constants:
 
     CONFIG = "./scripts/filter_entities/filter_entities_config.json"
     SIMILARITY_THRESHOLD = 70
+    WIKIDATA_URL = "https://www.wikidata.org/w/api.php"
+    BATCH_SIZE = 100
+    MAX_CONCURRENT_REQUESTS = 16
+    CONNECTION_LIMIT = 32
+    KEEPALIVE_TIMEOUT = 60
+    LINKED_LABEL_CACHE_SIZE = 200000
+    CACHE_PATH = "./scripts/filter_entities/wikidata_cache.sqlite"
+    PROGRESS_FLUSH_SECONDS = 5
+    WRITE_BUFFER_SIZE = 2**20
+    WRITE_INTERVAL_SECONDS = 30
+    MAX_RETRIES = 3
+    RETRY_BACKOFF_SECONDS = 1
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+# The progress is held in memory and only written to disk every few seconds
+progress_config = {}
+progress_dirty = False
+progress_last_flush = time.monotonic()
 
 
 def setup_logging():
@@ -32,94 +58,136 @@ def setup_logging():
     )
 
 
-def update_progress_config(key_path, value):
+def load_progress_config():
     """
-    Updates a nested key in the progress JSON file with a given value if the key path exists.
-
-    :param key_path: List of keys representing the path to the nested key.
-    :param value: The new value to assign to the key.
+    Loads the config JSON file, which also tracks the progress, into memory. All progress updates
+    are made to this copy.
     """
 
-    # Load the JSON progress file
-    with open(file=Constants.CONFIG, mode="r+", encoding="utf-8") as progress_file:
+    global progress_config
+
+    # Load the JSON config file
+    with open(file=Constants.CONFIG, mode="r", encoding="utf-8") as progress_file:
 
         progress_config = json.load(progress_file)
 
-        # Navigate to the nested dictionary
-        current_level = progress_config
+    # Progress saved before the byte offset was tracked has no offset, so the saved line is skipped
+    # to instead
+    for progress in progress_config.values():
 
-        # Traverse all but the last key
-        for key in key_path[:-1]:
+        progress.setdefault("offset", 0)
 
-            if key in current_level:
 
-                current_level = current_level[key]
+def flush_progress(sync=False):
+    """
+    Writes the in-memory progress to the config JSON file if it has changed. The file is written
+    to a temporary file first and then swapped in, so it is never left half written.
 
-            else:
+    :param sync: Whether to wait for the progress to reach the disk, only needed on shutdown.
+    """
 
-                logging.info("Key path \"%s\" not found in the JSON file.", " -> ".join(key_path))
+    global progress_dirty, progress_last_flush
 
-                # Exit if any key in the path doesn"t exist
-                return
+    # Skip the write if nothing has changed since the last flush
+    if not progress_dirty:
 
-        # Update the value of the last key
-        last_key = key_path[-1]
+        return
 
-        if last_key in current_level:
+    temp_file_path = Constants.CONFIG + ".tmp"
 
-            current_level[last_key] = value
+    # Write the progress to the temporary file
+    with open(file=temp_file_path, mode="w", encoding="utf-8") as progress_file:
 
-        else:
+        json.dump(progress_config, progress_file)
 
-            logging.info("Key \"%s\" not found in the JSON file.", last_key)
+        if sync:
 
-            return
+            progress_file.flush()
+            os.fsync(progress_file.fileno())
 
-        # Output the new config
-        progress_file.seek(0)
-        json.dump(progress_config, progress_file, indent=4)
+    # Atomically replace the old config file
+    os.replace(temp_file_path, Constants.CONFIG)
 
-        # Truncate the rest of the file if the new content is shorter
-        progress_file.truncate()
+    progress_dirty = False
+    progress_last_flush = time.monotonic()
 
-        logging.info("Updated key path \"%s\" with value \"%s\".", " -> ".join(key_path), value,)
 
+def handle_sigterm(signum, frame):
+    """
+    Exits cleanly on SIGTERM so the progress is flushed by the exit handler.
 
-def best_single_record_similarity(original_term, record):
+    :param signum: The number of the signal received.
+    :param frame: The current stack frame.
     """
-    Each Wikidata result contains a label and 0 or more aliases. This function gets the best
-    similarity from all of these. For example, if we search "CIA" we may get a result labeled
-    "Central Intelligence Agency" that has an alias "CIA". In this case, we want to take the
-    similarity for the alias "CIA", not the label "Central Intelligence Agency.
 
-    :param original_term: The original search term to get results from Wikidata.
-    :param record: A single record from Wikidata with a label and potential aliases.
-    :return: The best similarity across the label and all aliases.
+    sys.exit(128 + signum)
+
+
+def update_progress_config(key_path, value, flush=False):
+    """
+    Updates a nested key in the in-memory progress with a given value if the key path exists.
+    The progress is written to disk at most every few seconds, or immediately if requested.
+
+    :param key_path: List of keys representing the path to the nested key.
+    :param value: The new value to assign to the key.
+    :param flush: Whether to write the progress to disk straight away.
     """
 
-    # Extract the label and aliases
-    aliases = record.get("aliases", [])
+    global progress_dirty
+
+    # Navigate to the nested dictionary
+    current_level = progress_config
+
+    # Traverse all but the last key
+    for key in key_path[:-1]:
+
+        if key in current_level:
+
+            current_level = current_level[key]
 
-    # Combine the label and aliases into a single list
-    candidates = [record["label"]] + aliases
+        else:
+
+            logging.info("Key path \"%s\" not found in the progress config.", " -> ".join(key_path))
+
+            # Exit if any key in the path doesn"t exist
+            return
+
+    # Update the value of the last key
+    last_key = key_path[-1]
+
+    if last_key in current_level:
+
+        current_level[last_key] = value
+
+    else:
+
+        logging.info("Key \"%s\" not found in the progress config.", last_key)
+
+        return
+
+    progress_dirty = True
 
-    # Calculate the similarity for each candidate and track the highest
-    best_similarity = max(fuzz.ratio(candidate, original_term) for candidate in candidates)
+    # Write the progress to disk once enough time has passed since the last write
+    if flush or time.monotonic() - progress_last_flush >= Constants.PROGRESS_FLUSH_SECONDS:
 
-    return best_similarity
+        flush_progress()
 
+    logging.info("Updated key path \"%s\" with value \"%s\".", " -> ".join(key_path), value,)
 
-def search_wikidata(term):
+
+async def search_wikidata(session, semaphore, term):
     """
-    This function queries Wikidata with a value.
+    This function queries Wikidata with a value. Rate-limited and server errors, dropped
+    connections and timeouts are retried a few times, backing off longer after each attempt, or
+    as long as Wikidata asks for.
 
+    :param session: The shared aiohttp session to send the request with.
+    :param semaphore: Semaphore capping the number of requests in flight at once.
     :param term: The term to search for.
-    :return: A list of dictionaries, containing the results of the search from Wikidata.
+    :return: A list of dictionaries, containing the results of the search from Wikidata, or None
+    if the request failed.
     """
 
-    # Set the wikidata URL
-    url = "https://www.wikidata.org/w/api.php"
-
     # Set parameters for the call
     params = {
         "action": "wbsearchentities",
@@ -133,29 +201,210 @@ def search_wikidata(term):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0"
     }
 
-    # Send the request
-    response = requests.get(
-        url=url,
-        params=params,
-        headers=headers,
-        timeout=15
+    for attempt in range(Constants.MAX_RETRIES + 1):
+
+        # Back off exponentially between attempts, unless Wikidata asks to wait longer
+        delay = Constants.RETRY_BACKOFF_SECONDS * 2**attempt
+
+        try:
+
+            # Wait for a free slot so Wikidata isn't flooded, then send the request
+            async with semaphore, session.get(
+                url=Constants.WIKIDATA_URL,
+                params=params,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=15)
+                ) as response:
+
+                # If we get a successful response, return the response
+                if response.status == 200:
+
+                    return (await response.json()).get("search", [])
+
+                # If we get an unauthorized error, stop the script immediately to avoid more
+                elif response.status == 403:
+
+                    logging.error("403 forbidden error querying Wikidata, exiting.")
+
+                    sys.exit(1)
+
+                error = response.status
+                retryable = response.status in Constants.RETRY_STATUSES
+
+                # Wait as long as Wikidata asks for if it says
+                retry_after = response.headers.get("Retry-After", "")
+
+                if retry_after.isdigit():
+
+                    delay = max(delay, int(retry_after))
+
+        # A dropped connection or timed out request is retried like a server error, so one bad
+        # request can't stop every file being filtered on the event loop
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+
+            error = repr(e)
+            retryable = True
+
+        # Give up on errors that won't go away by retrying, or once out of retries
+        if not retryable or attempt == Constants.MAX_RETRIES:
+
+            break
+
+        logging.warning("Retrying Wikidata query for '%s' in %ss after error: %s", term, delay, error)
+
+        # Sleep after releasing the slot, so other requests can go ahead in the meantime
+        await asyncio.sleep(delay)
+
+    logging.error("Error querying Wikidata for '%s': %s", term, error)
+
+    return None
+
+
+def open_search_cache():
+    """
+    Opens the on-disk cache of Wikidata search results, creating it if it doesn't exist. The cache
+    persists between runs so a term is only ever searched for once.
+
+    :return: The connection to the SQLite cache.
+    """
+
+    # Connect to the cache, creating the file if needed
+    cache = sqlite3.connect(Constants.CACHE_PATH)
+
+    # Store the raw search results as JSON, keyed by the search term
+    cache.execute("CREATE TABLE IF NOT EXISTS cache (term TEXT PRIMARY KEY, results_json TEXT)")
+
+    return cache
+
+
+async def search_wikidata_cached(session, semaphore, cache, terms):
+    """
+    Gets the Wikidata search results for a list of terms, reading from the on-disk cache where
+    possible and querying the remaining terms concurrently. Successful queries are added to the
+    cache, failed ones are left out of the results so that they are retried the next time the
+    term is searched for.
+
+    :param session: The shared aiohttp session to send the requests with.
+    :param semaphore: Semaphore capping the number of requests in flight at once.
+    :param cache: The connection to the SQLite cache.
+    :param terms: A list of distinct terms to search for.
+    :return: A dictionary of each term and its list of search results.
+    """
+
+    # Look up all the terms in the cache at once
+    placeholders = ",".join("?" * len(terms))
+    results = {
+        term: json.loads(results_json)
+        for term, results_json in cache.execute(
+            f"SELECT term, results_json FROM cache WHERE term IN ({placeholders})", terms
+        )
+    }
+
+    # Send the queries for every term that wasn't cached at once
+    missing_terms = [term for term in terms if term not in results]
+    missing_results = await asyncio.gather(
+        *(search_wikidata(session, semaphore, term) for term in missing_terms)
+    )
+
+    # Keep the successful results and store them in the cache
+    new_results = {
+        term: term_results
+        for term, term_results in zip(missing_terms, missing_results)
+        if term_results is not None
+    }
+
+    if new_results:
+
+        cache.executemany(
+            "INSERT OR REPLACE INTO cache (term, results_json) VALUES (?, ?)",
+            [(term, json.dumps(term_results)) for term, term_results in new_results.items()]
         )
+        cache.commit()
+
+    results.update(new_results)
+
+    return results
+
+
+async def link_batch(session, semaphore, cache, linked_labels, records):
+    """
+    Links the head and tail of every record in a batch to Wikidata. All distinct terms in the
+    batch that haven't been linked before are searched for concurrently, so the batch takes about
+    as long as its slowest request.
+
+    :param session: The shared aiohttp session to send the requests with.
+    :param semaphore: Semaphore capping the number of requests in flight at once.
+    :param cache: The connection to the SQLite cache of search results.
+    :param linked_labels: An ordered dictionary of recently linked terms and their labels, or
+    None if the term couldn't be linked, with the most recently used last. New terms are added to
+    it and the least recently used are evicted once it is full.
+    :param records: A list of records, each with a head and a tail.
+    :return: A list of (linked_head, linked_tail) tuples in the same order as the records.
+    """
 
-    # If we get a successful response, return the response
-    if response.status_code == 200:
+    # Collect each distinct term in the batch, entities repeat heavily
+    batch_terms = dict.fromkeys(
+        term for record in records for term in (record["head"], record["tail"])
+    )
 
-        return response.json().get("search", [])
+    # Keep the labels for this batch separately, other files are linked at the same time and may
+    # evict them from the shared cache while the searches are awaited
+    labels = {}
+    terms = []
 
-    # If we get an unauthorized error, stop the script immediately to avoid more
-    elif response.status_code == 403:
+    # Find the terms that haven't been linked yet
+    for term in batch_terms:
 
-        logging.error("403 forbidden error querying Wikidata, exiting.")
+        if term in linked_labels:
 
-        sys.exit(1)
+            # Mark the term as recently used so it isn't evicted
+            linked_labels.move_to_end(term)
+            labels[term] = linked_labels[term]
+
+        else:
 
-    logging.error("Error querying Wikidata for '%s': %s", term, response.status_code)
+            terms.append(term)
 
-    return []
+    # Blank terms can't match any Wikidata label, so they're left unlinked without a search
+    for term in terms:
+
+        if not term.strip():
+
+            linked_labels[term] = labels[term] = None
+
+    terms = [term for term in terms if term.strip()]
+
+    if terms:
+
+        # Get the search results for the new terms
+        results = await search_wikidata_cached(session, semaphore, cache, terms)
+
+        # Find the best matching label for each term, the label only depends on the term so it
+        # can be reused every time the term appears again
+        for term in terms:
+
+            # A term whose search failed is left unlinked for this batch only, it is kept out of
+            # the cache so that it is searched for again the next time it appears
+            if term not in results:
+
+                labels[term] = None
+
+                continue
+
+            linked_labels[term] = labels[term] = filter_wikidata_results(
+                term,
+                results[term],
+                Constants.SIMILARITY_THRESHOLD
+            )
+
+    linked_entities = [(labels[record["head"]], labels[record["tail"]]) for record in records]
+
+    # Evict the least recently used terms once the cache is full
+    while len(linked_labels) > Constants.LINKED_LABEL_CACHE_SIZE:
+
+        linked_labels.popitem(last=False)
+
+    return linked_entities
 
 
 def filter_wikidata_results(original_term, wikidata_results, threshold):
@@ -163,6 +412,11 @@ def filter_wikidata_results(original_term, wikidata_results, threshold):
     Filter Wikidata search results based on Levenshtein similarity, retaining only results that
     meet the threshold and selecting the top match.
 
+    Each Wikidata result contains a label and 0 or more aliases, and a result scores the best
+    similarity of any of these. For example, if we search "CIA" we may get a result labeled
+    "Central Intelligence Agency" that has an alias "CIA". In this case, we want to take the
+    similarity for the alias "CIA", not the label "Central Intelligence Agency".
+
     :param original_name: The original name of the entity from the input data.
     :param wikidata_results: A list of Wikidata search results for the entity.
     :param threshold: The minimum similarity score to accept a match (0-100).
@@ -170,141 +424,206 @@ def filter_wikidata_results(original_term, wikidata_results, threshold):
     return None.
     """
 
-    # Initialize variables to track the best match
-    best_match = None
-    highest_similarity = 0
+    # Flatten the labels and aliases of every result into one list of candidates, keeping the
+    # label of the result each candidate came from
+    candidates = []
+    candidate_labels = []
 
-    # Iterate through results to calculate similarity
     for result in wikidata_results:
 
-        # For all labels and aliases for a single wikidata result, find the best similarity
-        similarity = best_single_record_similarity(original_term, result)
+        for candidate in [result["label"]] + result.get("aliases", []):
+
+            candidates.append(candidate)
+            candidate_labels.append(result["label"])
+
+    # An exact match always scores 100, so return the first one without scoring anything
+    if original_term in candidates:
 
-        # If a record has a perfect similarity, return it immediately
-        if similarity == 100:
+        return candidate_labels[candidates.index(original_term)]
 
-            return result["label"]
+    # Score all candidates in a single call. The first candidate with the highest similarity wins,
+    # so an earlier result is preferred on ties, and scoring stops at the first perfect match
+    best_match = process.extractOne(
+        original_term,
+        candidates,
+        scorer=fuzz.ratio,
+        score_cutoff=threshold
+    )
+
+    # Return None if no results passed the threshold
+    if best_match is None:
 
-        # Only consider matches that meet the threshold and are better than the current best match
-        if similarity > highest_similarity and similarity >= threshold:
+        return None
 
-            # Store the best match and similarity if the threshold is passed
-            best_match = result["label"]
-            highest_similarity = similarity
+    # Return the label of the result the best candidate belongs to
+    _, _, candidate_index = best_match
 
-    # Return the best match, or None if no results passed the threshold
-    return best_match
+    return candidate_labels[candidate_index]
 
 
-def process_and_link_entities(data_source_name, input_file_path, output_file_path, current_line):
+async def link_and_buffer_batch(session, semaphore, cache, linked_labels, batch, out_buffer):
+    """
+    Links a batch of records to Wikidata and adds the linked triplets to the output buffer as
+    JSON lines. The batch list is cleared afterwards so it can be reused.
+
+    :param session: The shared aiohttp session to send the requests with.
+    :param semaphore: Semaphore capping the number of requests in flight at once.
+    :param cache: The connection to the SQLite cache of search results.
+    :param linked_labels: A dictionary of each term linked so far and its label.
+    :param batch: A list of (line number, record) tuples to link.
+    :param out_buffer: The byte buffer to accumulate the linked triplets in before writing.
+    """
+
+    # Nothing to do for an empty batch
+    if not batch:
+
+        return
+
+    # Entity linking for head and tail of every record in the batch
+    linked_entities = await link_batch(
+        session,
+        semaphore,
+        cache,
+        linked_labels,
+        [record for _, record in batch]
+    )
+
+    for (line_number, record), (linked_head, linked_tail) in zip(batch, linked_entities):
+
+        head = record["head"]
+        tail = record["tail"]
+
+        # If both the head and tail of the triplet were linked, add it to the buffer
+        if linked_head and linked_tail:
+
+            # Create the triplet
+            triplet = {
+                "linked_head": linked_head,
+                "original_head": head,
+                "type": record["type"],
+                "linked_tail": linked_tail,
+                "original_tail": tail
+            }
+
+            out_buffer += orjson.dumps(triplet)
+            out_buffer += b"\n"
+
+        else:
+
+            logging.warning(
+                "Failed to link entities: head=%s, tail=%s. Skipping line %s.",
+                head,
+                tail,
+                line_number
+            )
+
+    # Clear the batch after linking
+    batch.clear()
+
+
+async def process_and_link_entities(
+    session,
+    semaphore,
+    cache,
+    linked_labels,
+    data_source_name,
+    input_file_path,
+    output_file_path,
+    current_line,
+    current_offset
+):
     """
     Process a knowledge graph by reading input data, linking entities to Wikidata,
     collapsing duplicate edges, and normalizing edge strengths.
 
+    :param session: The shared aiohttp session to send the requests with.
+    :param semaphore: Semaphore capping the number of requests in flight at once.
+    :param cache: The connection to the SQLite cache of search results.
+    :param linked_labels: An ordered dictionary of recently linked terms and their labels.
     :param file: Name of the file being processed (used for logging and progress tracking).
     :param input_file: Path to the input .jsonl file containing raw knowledge graph entities.
     :param output_file: Path to the output .jsonl file to save filtered knowledge graph entities.
     :param threshold: The minimum similarity score for entity linking (0-100).
     :param current_line: Line number from which to resume processing.
+    :param current_offset: Byte offset of the end of the current line in the input file.
     """
 
     logging.info("Starting entity filtering. Reading input from %s", input_file_path)
 
     # Open input and output files
-    with open(file=input_file_path, mode="r", encoding="utf-8") as in_file, \
-        open(file=output_file_path, mode="a", encoding="utf-8") as out_file:
-
-        # Set default starting line number
-        line_number = 1
+    with open(file=input_file_path, mode="rb") as in_file, \
+        open(file=output_file_path, mode="ab") as out_file:
 
-        # List to accumulate the triplets
-        triplets = []
+        # Jump straight past the lines we've already processed
+        if current_offset or not current_line:
 
-        for line_number, input_file_line in enumerate(iterable=in_file, start=line_number):
+            in_file.seek(current_offset)
 
-            # If a line has already been processed, skip it
-            if line_number < current_line:
+        else:
 
-                # Skip already processed lines
-                continue
+            # Older progress only recorded the line, so skip the processed lines one at a time
+            for _ in range(current_line):
 
-            # Load the entities
-            record = json.loads(input_file_line)
-            head = record["head"]
-            tail = record["tail"]
+                in_file.readline()
 
-            # Entity linking for head and tail
-            head_results = search_wikidata(head)
-            linked_head = filter_wikidata_results(
-                head,
-                head_results,
-                Constants.SIMILARITY_THRESHOLD
-                )
+        # Set default line number, in case there are no lines left to process
+        line_number = current_line
 
-            tail_results = search_wikidata(tail)
-            linked_tail = filter_wikidata_results(
-                tail,
-                tail_results,
-                Constants.SIMILARITY_THRESHOLD
-                )
+        # List to accumulate the records waiting to be linked, with their line numbers
+        batch = []
 
-            # If both the head and tail of the triplet were linked, add it to the list
-            if linked_head and linked_tail:
+        # Byte buffer to accumulate the linked triplets as JSON lines, written in large chunks
+        out_buffer = bytearray()
+        last_write_time = time.monotonic()
 
-                # Create the triplet and write it directly to the file
-                triplet = {
-                    "linked_head": linked_head,
-                    "original_head": head,
-                    "type": record["type"],
-                    "linked_tail": linked_tail,
-                    "original_tail": tail
-                }
+        for line_number, input_file_line in enumerate(iterable=in_file, start=current_line + 1):
 
-                triplets.append(triplet)
+            # Load the entities
+            batch.append((line_number, orjson.loads(input_file_line)))
 
-            else:
+            # Link the batch every 100 lines
+            if line_number % Constants.BATCH_SIZE == 0:
 
-                logging.warning(
-                    "Failed to link entities: head=%s, tail=%s. Skipping line %s.",
-                    head,
-                    tail,
-                    line_number
+                await link_and_buffer_batch(
+                    session, semaphore, cache, linked_labels, batch, out_buffer
                 )
 
-            # Log progress every 100 lines
-            if line_number % 100 == 0:
-
                 logging.info("Processed %s lines...", line_number)
 
-                # Write the accumulated triplets to the output file
-                if triplets:
-
-                    for triplet in triplets:
-
-                        json.dump(triplet, out_file)
-                        out_file.write("\n")
-
-                    # Clear the list after writing
-                    triplets.clear()
-
-                # Update progress in the config
-                update_progress_config(
-                    key_path=[data_source_name, "line"],
-                    value=line_number
-                )
-
-        # Final write if there are remaining triplets
-        if triplets:
-
-            for triplet in triplets:
+                # Write the buffer once it fills up or hasn't been written in a while
+                if len(out_buffer) >= Constants.WRITE_BUFFER_SIZE \
+                    or time.monotonic() - last_write_time >= Constants.WRITE_INTERVAL_SECONDS:
+
+                    out_file.write(out_buffer)
+                    out_buffer.clear()
+                    last_write_time = time.monotonic()
+
+                    # Update progress in the config only once the output is written, so it never
+                    # runs ahead of the output. The offset is recorded first so that the saved
+                    # line never runs ahead of it
+                    update_progress_config(
+                        key_path=[data_source_name, "offset"],
+                        value=in_file.tell()
+                    )
+                    update_progress_config(
+                        key_path=[data_source_name, "line"],
+                        value=line_number
+                    )
+
+        # Link the remaining records and write whatever is left in the buffer
+        await link_and_buffer_batch(
+            session, semaphore, cache, linked_labels, batch, out_buffer
+        )
 
-                json.dump(triplet, out_file)
-                out_file.write("\n")
+        if out_buffer:
 
-            # Clear the list after writing
-            triplets.clear()
+            out_file.write(out_buffer)
 
         # Final progress update
+        update_progress_config(
+            key_path=[data_source_name, "offset"],
+            value=in_file.tell()
+        )
         update_progress_config(
             key_path=[data_source_name, "line"],
             value=line_number
@@ -313,47 +632,110 @@ def process_and_link_entities(data_source_name, input_file_path, output_file_pat
     logging.info("Entity filtering completed. Output written to %s.", output_file_path)
 
 
-if __name__ == "__main__":
+async def filter_file(session, semaphore, cache, linked_labels, config, data_source):
+    """
+    Filters the entities in one file, picking up where the last run left off, and marks the file
+    as processed once it's done.
+
+    :param session: The shared aiohttp session to send the requests with.
+    :param semaphore: Semaphore capping the number of requests in flight at once.
+    :param cache: The connection to the SQLite cache of search results.
+    :param linked_labels: An ordered dictionary of recently linked terms and their labels.
+    :param config: The config for each file, including its path and progress.
+    :param data_source: The key of the file in the config.
+    """
 
-    # Setup logging functionality
-    setup_logging()
+    logging.info("Filtering %s...", data_source)
+
+    # Extract the filepath and current line and byte offset we are on
+    input_file = config[data_source]["path"]
+    line = config[data_source]["line"]
+    offset = config[data_source].get("offset", 0)
+
+    # Split the path into components
+    directory, filename = os.path.split(input_file)
+
+    # Replace the directory and filename
+    new_directory = directory.replace("raw_entities", "filtered_entities")
+    new_filename = filename.replace("_raw_entities", "_filtered_entities")
+
+    # Construct the output file path
+    output_file = os.path.join(new_directory, new_filename)
+
+    # Filter entities
+    await process_and_link_entities(
+        session,
+        semaphore,
+        cache,
+        linked_labels,
+        data_source,
+        input_file,
+        output_file,
+        line,
+        offset
+    )
 
-    # Load the JSON config file
-    with open(file=Constants.CONFIG, mode="r", encoding="utf-8") as config_file:
+    # Update the config with our progress
+    update_progress_config(
+        key_path=[data_source, "status"],
+        value=True,
+        flush=True
+        )
+
+
+async def filter_all_entities(config):
+    """
+    Filters the entities in every file that hasn't been processed yet. The files are filtered at
+    the same time on the one event loop, so one file's batch is parsed and scored while another's
+    requests are in flight. All files share the same HTTP connections, request limit and search
+    results cache.
+
+    :param config: The config for each file, including its path and progress.
+    """
+
+    # Share one pool of keep-alive connections across every request in the run, holding idle
+    # connections open long enough to be reused between batches
+    connector = aiohttp.TCPConnector(
+        limit=Constants.CONNECTION_LIMIT,
+        keepalive_timeout=Constants.KEEPALIVE_TIMEOUT
+    )
+    semaphore = asyncio.BoundedSemaphore(Constants.MAX_CONCURRENT_REQUESTS)
 
-        config = json.load(config_file)
+    # Open the search results cache, and keep the labels linked for recent terms in memory so
+    # entities that recur across files aren't linked again
+    cache = open_search_cache()
+    linked_labels = OrderedDict()
 
-    # Enumerate over the individual files we're going to process
-    for data_source in config:
+    # Do not process the files we've already processed (e.g. "True")
+    pending_files = [
+        data_source for data_source in config if config[data_source]["status"] is not True
+    ]
 
-        logging.info("Filtering %s...", data_source)
+    async with aiohttp.ClientSession(connector=connector) as session:
 
-        # Do not process the file if we've already processed it (e.g. "True")
-        if config[data_source]["status"] is True:
+        # Filter the pending files concurrently, an error in any file is re-raised here
+        await asyncio.gather(*(
+            filter_file(session, semaphore, cache, linked_labels, config, data_source)
+            for data_source in pending_files
+        ))
 
-            continue
+    # Close the search results cache
+    cache.close()
 
-        # Extract the filepath and current line we are on
-        input_file = config[data_source]["path"]
-        line = config[data_source]["line"]
 
-        # Split the path into components
-        directory, filename = os.path.split(input_file)
+if __name__ == "__main__":
 
-        # Replace the directory and filename
-        new_directory = directory.replace("raw_entities", "filtered_entities")
-        new_filename = filename.replace("_raw_entities", "_filtered_entities")
+    # Setup logging functionality
+    setup_logging()
 
-        # Construct the output file path
-        output_file = os.path.join(new_directory, new_filename)
+    # Load the JSON config file into memory, it also holds the progress
+    load_progress_config()
 
-        # Filter entities
-        process_and_link_entities(data_source, input_file, output_file, line)
+    # Make sure the latest progress is written to disk however the script exits
+    atexit.register(flush_progress, sync=True)
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
-        # Update the config with our progress
-        update_progress_config(
-            key_path=[data_source, "status"],
-            value=True
-            )
+    # Filter every file, running the Wikidata queries on a single event loop
+    asyncio.run(filter_all_entities(progress_config))
 
     logging.info("All entities filtered.")
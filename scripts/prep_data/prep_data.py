@@ -1,8 +1,18 @@
 # Import third party libraries
+import zstandard
+import msgspec
+import orjson
 import spacy
 
 # Import native libraries
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+import multiprocessing
 import logging.handlers
+import hashlib
+import gzip
+import re
+import io
 import json
 import os
 
@@ -11,115 +21,320 @@ log = logging.getLogger("logger")
 log.setLevel(logging.INFO)
 log.addHandler(logging.StreamHandler())
 
-# Load spaCy"s pre-trained NER model
-nlp = spacy.load("en_core_web_sm")
+
+# Set constant values for the script, enforcing them with a class
+class Constants:
+    """
+    A class specifically for enforcing constant values in the script.
+    """
+
+    NER_BATCH_SIZE = 512
+    NER_PROCESSES = max(1, (os.cpu_count() or 1) - 1)
+    GPU_NER_BATCH_SIZE = 128
+    WRITE_BUFFER_SIZE = 2**20
+    UNUSED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+    MIN_WORDS_RE = re.compile(r"\s*+\S++(?:\s++\S++){9}")
+    COMPRESSED_EXTENSIONS = (".zst", ".gz")
+    NER_CACHE_SIZE = 500000
 
 
-def filter_entries(text):
+class Comment(msgspec.Struct):
     """
-    Takes a string of text and determines if it is worth feeding into the model. If so, it is returned.
+    The fields of an extracted comment that are used, any other fields are skipped when decoding.
+    """
+
+    author: str | None = None
+    body: str | None = None
+
 
-    :param text: The text that is being evaluated.
+class Submission(msgspec.Struct):
+    """
+    The fields of an extracted submission that are used, any other fields are skipped when
+    decoding.
     """
 
-    # If the text has less than 10 words, drop the text
-    if len(text.split()) < 10:
+    title: str | None = None
+    body: str | None = None
 
-        return None
-    
-    # Apply named entity recognition to the text
-    doc = nlp(text)
 
-    # If there are no entities, drop the text
-    if len(doc.ents) == 0:
+# Decode each line straight into the typed records, only the fields above are ever built
+comment_decoder = msgspec.json.Decoder(Comment)
+submission_decoder = msgspec.json.Decoder(Submission)
 
-        return None
-    
-    # If the tests are passed, return the original text
-    return text
 
+# spaCy's NER model and the settings it runs with, loaded separately in every process that uses it
+nlp = None
+ner_batch_size = Constants.NER_BATCH_SIZE
+ner_processes = Constants.NER_PROCESSES
 
-def clean_comments(extracted_data_filepath):
+
+def load_model(use_gpu, processes):
     """
-    Reads a JSONL file line by line, applies conditional logic, and writes matching lines to a new file.
+    Loads spaCy's pre-trained NER model into this process, using the more accurate transformer
+    model on the GPU. The GPU model takes smaller batches and has to run in a single process.
+    Only the entities are used, so the other components of the pipeline are never loaded.
 
-    :param extracted_data_filepath: Path to the input JSONL file.
+    :param use_gpu: Whether spaCy has been set up to run on the GPU.
+    :param processes: The number of processes to spread the CPU model's batches across.
     """
 
-    # Split the path into components
-    directory, filename = os.path.split(extracted_data_filepath)
+    global nlp, ner_batch_size, ner_processes
 
-    # Replace the directory from "raw_data" to "prepped_data"
-    new_directory = directory.replace("extracted_data", "prepped_data")
+    if use_gpu:
 
-    # Rename the new file by appending "_prepped.jsonl" to the end
-    new_filename = os.path.splitext(filename)[0] + "_prepped.jsonl"
+        # The NER component reads its features from the shared transformer, so that is kept
+        nlp = spacy.load("en_core_web_trf", exclude=Constants.UNUSED_PIPES)
+        ner_batch_size = Constants.GPU_NER_BATCH_SIZE
+        ner_processes = 1
 
-    # Construct the new file path
-    jsonl_output_file = os.path.join(new_directory, new_filename)
+    else:
 
-    # Open the input and output files
-    with open(extracted_data_filepath, "r") as infile, open(jsonl_output_file, "w") as outfile:
+        # The NER component has its own embedding layer, so the shared one can go as well
+        nlp = spacy.load("en_core_web_sm", exclude=Constants.UNUSED_PIPES + ["tok2vec"])
+        ner_batch_size = Constants.NER_BATCH_SIZE
+        ner_processes = processes
+
+
+def queue_unique_texts(texts, pending, verdicts, in_flight):
+    """
+    Passes each text through to the NER model the first time it appears, and adds every text to
+    the pending queue in its original order. A text shares a verdict holder with its repeats, a
+    one-item list that is filled in with whether it has entities once the NER model has run on
+    it. Recent holders are kept in a cache keyed on a digest of the text, the least recently used
+    are evicted once it is full, so a repeat seen long after is just run through the model again.
+
+    Only the digest is sent along with the text to the NER model. With more than one process
+    spaCy hands back copies of whatever is sent, so the holders have to stay in this process and
+    are looked up by digest when the text comes back.
+
+    :param texts: An iterable of texts.
+    :param pending: A deque to add each text to along with its verdict holder.
+    :param verdicts: An ordered dictionary of recent text digests and their verdict holders.
+    :param in_flight: A dictionary of the digests of the texts sent to the NER model and their
+    verdict holders, until the model has run on them.
+    :yield: Each text that needs the NER model run on it, along with its digest.
+    """
+
+    for text in texts:
+
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        verdict = verdicts.get(digest)
+
+        if verdict is not None:
+
+            # Mark the text as recently used so it isn't evicted
+            verdicts.move_to_end(digest)
+
+        elif digest in in_flight:
+
+            # The text was evicted while still waiting on the model, share its holder again
+            verdict = in_flight[digest]
+            verdicts[digest] = verdict
+
+        else:
+
+            # The first time the text has been seen recently, so run the NER model on it
+            verdict = [None]
+            verdicts[digest] = verdict
+            in_flight[digest] = verdict
+
+            yield text, digest
+
+        # Evict the least recently used text once the cache is full
+        if len(verdicts) > Constants.NER_CACHE_SIZE:
+
+            verdicts.popitem(last=False)
+
+        pending.append((text, verdict))
+
+
+def filter_entries(texts):
+    """
+    Takes a stream of texts and determines which are worth feeding into the model. Those that are
+    are yielded in their original order. The NER model runs over the texts in batches, spread
+    across several processes, rather than one text at a time. Repeated texts are only run through
+    the model once, but every occurrence is still yielded so the counts downstream are kept.
+
+    :param texts: An iterable of the texts that are being evaluated.
+    :yield: Each text that passed the filters.
+    """
+
+    # If the text is missing or has less than 10 words, drop the text. This also drops deleted
+    # and removed texts, which are a single word. The word count is checked by matching the first
+    # 10 words, so long texts are never split into a list
+    texts = (
+        text for text in texts
+        if text is not None and Constants.MIN_WORDS_RE.match(text)
+    )
+
+    # Texts waiting for their verdict, in their original order, the verdicts of recent texts and
+    # the verdicts still waiting on the model
+    pending = deque()
+    verdicts = OrderedDict()
+    in_flight = {}
+
+    # Apply named entity recognition to the texts in batches, bot replies and copied posts repeat
+    # heavily so each text only goes through the model once
+    for doc, digest in nlp.pipe(
+        queue_unique_texts(texts, pending, verdicts, in_flight),
+        as_tuples=True,
+        batch_size=ner_batch_size,
+        n_process=ner_processes
+    ):
+
+        # Keep the text only if it has entities
+        in_flight.pop(digest)[0] = len(doc.ents) > 0
+
+        # Release every text at the front of the queue whose verdict is known
+        while pending and pending[0][1][0] is not None:
+
+            text, text_verdict = pending.popleft()
+
+            # If the tests are passed, return the original text
+            if text_verdict[0]:
+
+                yield text
+
+    # Every verdict is known once the model has run on all the texts
+    for text, text_verdict in pending:
+
+        if text_verdict[0]:
+
+            yield text
+
+
+def read_comment_texts(infile):
+    """
+    Reads the comments from a JSONL file line by line, yielding the text of each one that wasn't
+    written by the AutoModerator.
 
-        # Use a list to accumulate valid lines for batch writing
-        valid_lines = []
+    :param infile: The open input JSONL file.
+    :yield: The body of each comment.
+    """
+
+    # Enumerate through each line in the input file
+    for line in infile:
+
+        try:
+
+            # Parse the line as JSON
+            comment = comment_decoder.decode(line)
+
+            # Remove lines where the AutoModerator is commenting
+            if comment.author == "AutoModerator":
+
+                log.debug("Skipping line due to AutoModerator comment: %r", comment)
+
+                continue
 
-        # Enumerate through each line in the input file
-        for line in infile:
+            yield comment.body
 
-            try:
+        except msgspec.DecodeError:
+            log.info("Skipping invalid JSON line: %r", line[:200])
 
-                # Parse the line as JSON
-                obj = json.loads(line.strip())
 
-                # Try to extract title and body
-                author = obj.get("author")
-                body = obj.get("body")
+def read_submission_texts(infile):
+    """
+    Reads the submissions from a JSONL file line by line, yielding the title and then the body of
+    each one.
 
-                # Remove lines where the AutoModerator is commenting
-                if author == "AutoModerator":
+    :param infile: The open input JSONL file.
+    :yield: The title and body of each submission.
+    """
 
-                    log.debug(f"Skipping line due to AutoModerator comment: {obj}")
+    # Enumerate through each line in the input file
+    for line in infile:
 
-                    continue
+        try:
 
-                # Pass the body through the filter
-                body = filter_entries(body)
+            # Parse the line as JSON
+            submission = submission_decoder.decode(line)
 
-                # If body passed the filter, add it
-                if body is not None:
+            # Yield the title and body
+            yield submission.title
+            yield submission.body
 
-                    valid_lines.append(json.dumps({"text": body}))
+        except msgspec.DecodeError:
+            log.info("Skipping invalid JSON line: %r", line[:200])
 
-            except json.JSONDecodeError:
-                log.info(f"Skipping invalid JSON line: {line.strip()}")
 
-            # Batch write to the output file after every 100 lines for efficiency
-            if len(valid_lines) >= 100:
+def write_filtered_texts(texts, outfile):
+    """
+    Passes a stream of texts through the filter and writes the ones that pass to the output file
+    in large chunks.
 
-                # Write the lines to the output file
-                outfile.write("\n".join(valid_lines) + "\n")
+    :param texts: An iterable of the texts to filter.
+    :param outfile: The open output JSONL file.
+    """
 
-                # Reset the batch list
-                valid_lines.clear()
+    # Use a byte buffer to accumulate valid lines for writing, serialized straight to bytes
+    buffer = bytearray()
 
-        # After finishing the loop, write any remaining valid lines
-        if valid_lines:
+    # Pass the texts through the filter
+    for text in filter_entries(texts):
+
+        buffer += orjson.dumps({"text": text})
+        buffer += b"\n"
+
+        # Write to the output file once the buffer fills up
+        if len(buffer) >= Constants.WRITE_BUFFER_SIZE:
 
             # Write the lines to the output file
-            outfile.write("\n".join(valid_lines) + "\n")
+            outfile.write(buffer)
 
+            # Reset the buffer
+            buffer.clear()
 
-def clean_submissions(extracted_data_filepath):
+    # After finishing the loop, write any remaining valid lines
+    if buffer:
+
+        # Write the lines to the output file
+        outfile.write(buffer)
+
+
+def open_data_file(file_path):
     """
-    Reads a JSONL file line by line, applies conditional logic, and writes matching lines to a new file.
+    Opens a JSONL file for reading line by line in binary mode. Files ending in .zst or .gz are
+    decompressed on the fly, so the extracted data can be kept compressed on disk.
+
+    :param file_path: Path to the JSONL file, optionally Zstandard or gzip compressed.
+    :return: The open file.
+    """
+
+    if file_path.endswith(".zst"):
+
+        # The Reddit archives need the max window size, and the decompression reader has to be
+        # buffered to be read line by line
+        return io.BufferedReader(zstandard.open(
+            file_path,
+            "rb",
+            dctx=zstandard.ZstdDecompressor(max_window_size=2**31)
+        ))
+
+    if file_path.endswith(".gz"):
+
+        return gzip.open(file_path, "rb")
+
+    return open(file_path, "rb")
+
+
+def prepped_file_path(extracted_data_filepath):
+    """
+    Builds the path the prepped data for an input file is written to. The output is always
+    written uncompressed, since the entity extraction resumes by seeking to a byte offset in it.
 
     :param extracted_data_filepath: Path to the input JSONL file.
+    :return: Path to the output JSONL file.
     """
 
     # Split the path into components
     directory, filename = os.path.split(extracted_data_filepath)
 
+    # Drop the compression extension, if there is one
+    if filename.endswith(Constants.COMPRESSED_EXTENSIONS):
+
+        filename = os.path.splitext(filename)[0]
+
     # Replace the directory from "raw_data" to "prepped_data"
     new_directory = directory.replace("extracted_data", "prepped_data")
 
@@ -127,57 +342,74 @@ def clean_submissions(extracted_data_filepath):
     new_filename = os.path.splitext(filename)[0] + "_prepped.jsonl"
 
     # Construct the new file path
-    jsonl_output_file = os.path.join(new_directory, new_filename)
+    return os.path.join(new_directory, new_filename)
+
+
+def clean_comments(extracted_data_filepath):
+    """
+    Reads a JSONL file line by line, applies conditional logic, and writes matching lines to a new file.
+
+    :param extracted_data_filepath: Path to the input JSONL file.
+    """
+
+    # Construct the new file path
+    jsonl_output_file = prepped_file_path(extracted_data_filepath)
 
     # Open the input and output files
-    with open(extracted_data_filepath, "r") as infile, open(jsonl_output_file, "w") as outfile:
+    with open_data_file(extracted_data_filepath) as infile, \
+        open(jsonl_output_file, "wb", buffering=Constants.WRITE_BUFFER_SIZE) as outfile:
+
+        # Stream the comment bodies through the filter into the output file
+        write_filtered_texts(read_comment_texts(infile), outfile)
+
 
-        # Use a list to accumulate valid lines for batch writing
-        valid_lines = []
+def clean_submissions(extracted_data_filepath):
+    """
+    Reads a JSONL file line by line, applies conditional logic, and writes matching lines to a new file.
 
-        # Enumerate through each line in the input file
-        for line in infile:
+    :param extracted_data_filepath: Path to the input JSONL file.
+    """
+
+    # Construct the new file path
+    jsonl_output_file = prepped_file_path(extracted_data_filepath)
 
-            try:
+    # Open the input and output files
+    with open_data_file(extracted_data_filepath) as infile, \
+        open(jsonl_output_file, "wb", buffering=Constants.WRITE_BUFFER_SIZE) as outfile:
 
-                # Parse the line as JSON
-                obj = json.loads(line.strip())
+        # Stream the submission titles and bodies through the filter into the output file
+        write_filtered_texts(read_submission_texts(infile), outfile)
 
-                # Try to extract title and body
-                title = obj.get("title")
-                body = obj.get("body")
 
-                # Pass the title and body through the filter
-                title = filter_entries(title)
-                body = filter_entries(body)
+def process_config_entry(config_entry):
+    """
+    Processes a single file from the config file. Used as the unit of work for the process pool,
+    so it has to stay a module-level function that can be pickled.
 
-                # If title passed the filter, add it
-                if title is not None:
+    :param config_entry: A tuple of the config key and its values (path and type).
+    """
 
-                    valid_lines.append(json.dumps({"text": title}))
+    key, value = config_entry
 
-                # If body passed the filter, add it
-                if body is not None:
+    log.info("Processing %s data...", key)
 
-                    valid_lines.append(json.dumps({"text": body}))
+    # Extract the filepath and the values we want to extract from the raw files
+    extracted_data_filepath = value.get("path")
+    type = value.get("type")
 
-            except json.JSONDecodeError:
-                log.info(f"Skipping invalid JSON line: {line.strip()}")
+    # If we have submissions data, call the function specific for cleaning up the submissions data
+    if type == "submissions":
 
-            # Batch write to the output file after every 100 lines for efficiency
-            if len(valid_lines) >= 100:
+        clean_submissions(extracted_data_filepath)
 
-                # Write the lines to the output file
-                outfile.write("\n".join(valid_lines) + "\n")
+    # If we have comment data, call the function specific for cleaning up the comment data
+    elif type == "comments":
 
-                # Reset the batch list
-                valid_lines.clear()
+        clean_comments(extracted_data_filepath)
 
-        # After finishing the loop, write any remaining valid lines
-        if valid_lines:
+    else:
 
-            # Write the lines to the output file
-            outfile.write("\n".join(valid_lines) + "\n")
+        log.info("The %s data did not fit predetermined logic, check your config file...", key)
 
 
 if __name__ == "__main__":
@@ -187,36 +419,36 @@ if __name__ == "__main__":
     the transformer model.
     """
 
-    # Load spaCy"s pre-trained named entity recognition model
-    nlp = spacy.load("en_core_web_sm")
-
     # Open the config JSON file
     with open("./scripts/prep_data/prep_data_config.json", "r") as file:
 
         # Read the data into a dictionary
         config = json.load(file)
 
-    # Enumerate over the top-level keys and values in the config file
-    for key, value in config.items():
-
-        log.info(f"Processing {key} data...")
+    # The GPU can only be used by one process, so the files are processed one after the other
+    if spacy.prefer_gpu():
 
-        # Extract the filepath and the values we want to extract from the raw files
-        extracted_data_filepath = value.get("path")
-        type = value.get("type")
+        load_model(use_gpu=True, processes=1)
 
-        # If we have submissions data, call the function specific for cleaning up the submissions data
-        if type == "submissions":
+        for config_entry in config.items():
 
-            clean_submissions(extracted_data_filepath)
+            process_config_entry(config_entry)
 
-        # If we have comment data, call the function specific for cleaning up the comment data
-        elif type == "comments":
+    else:
 
-            clean_comments(extracted_data_filepath)
+        # Each file is independent, so run one worker process per file and split the cores
+        # between the workers for the NER batches
+        max_workers = min(len(config), os.cpu_count() or 1)
 
-        else:
+        # Start the workers fresh rather than forking, each one loads its own copy of the model
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=load_model,
+            initargs=(False, max(1, Constants.NER_PROCESSES // max_workers))
+        ) as executor:
 
-            log.info(f"The {key} data did not fit predetermined logic, check your config file...")
+            # Consume the results so an exception raised in a worker is re-raised here
+            list(executor.map(process_config_entry, config.items()))
 
     log.info("All files have been processed.")
@@ -1,14 +1,37 @@
 # Import third-party libraries
-from fuzzywuzzy import fuzz
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rapidfuzz import fuzz, process
 import requests
 
 # Import native libraries
 import logging
 import json
-import time
 import os
 
 
+# Share one session so every query reuses the same keep-alive connection to Wikidata, retrying
+# rate-limited and failed requests with a backoff. Once the retries run out the last response is
+# returned rather than raised, so it is logged and skipped like any other error
+session = requests.Session()
+session.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0"
+})
+session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False
+        )
+    )
+)
+
+
 def setup_logging():
     """
     Sets up logging configuration.
@@ -42,7 +65,7 @@ def search_wikidata(entity_name):
     }
 
     # Send the request
-    response = requests.get(url, params=params)
+    response = session.get(url, params=params, timeout=15)
 
     # If we get a successful response, return the response
     if response.status_code == 200:
@@ -67,9 +90,9 @@ def search_wikidata(entity_name):
         return []
 
 
-def best_single_record_similarity(original_term, record):
+def best_single_record_similarity(original_term, record, threshold):
 
-    logging.info(f"Calculating similarities for one Wikidata record...")
+    logging.debug("Calculating similarities for one Wikidata record...")
 
     # Extract the label and aliases
     label = record.get("label", "")
@@ -78,36 +101,41 @@ def best_single_record_similarity(original_term, record):
     # Combine the label and aliases into a single list
     candidates = [label] + aliases
 
-    # Compute similarity for each candidate
-    similarities = {candidate: fuzz.ratio(candidate, original_term) for candidate in candidates}
+    # An exact match always has a perfect similarity, so there's nothing to compute
+    if original_term in candidates:
 
-    logging.info(f"Here are all the similarities: {similarities}")
+        logging.debug("%s is an exact match for this record", original_term)
 
-    time.sleep(2)
-
-    # Initialize variables to track the best match and similarity
-    best_match = None
-    best_similarity = 0
+        return 100
 
-    # Iterate over the dictionary to find the candidate with the highest similarity
-    for candidate, similarity in similarities.items():
+    # The similarity can be at most 100 * (1 - |la - lc| / (la + lc)), so drop the candidates whose
+    # difference in length alone keeps them under the threshold
+    la = len(original_term)
 
-        logging.info(f"Checking {candidate} with similarity {similarity} against {original_term}...")
+    candidates = [
+        candidate for candidate in candidates
+        if abs(la - len(candidate)) * 100 <= (100 - threshold) * (la + len(candidate))
+    ]
 
-        time.sleep(2)
+    if not candidates:
 
-        if similarity == 100:
+        logging.debug("No candidates in this record are close enough in length to %s", original_term)
 
-            return label, best_similarity
+        return 0
 
-        if similarity > best_similarity:
+    # Compute similarity for every candidate in a single call, sorted from most to least similar
+    similarities = process.extract(original_term, candidates, scorer=fuzz.ratio, limit=None)
 
-            best_match = candidate
-            best_similarity = similarity
+    logging.debug("Here are all the similarities: %s", similarities)
 
-    logging.info(f"For this record, we are using {best_match} with a similarity of {best_similarity}")
+    # Take the most similar candidate, the earliest one wins on ties
+    best_match, best_similarity, _ = similarities[0]
 
-    time.sleep(2)
+    logging.debug(
+        "For this record, we are using %s with a similarity of %s",
+        best_match,
+        best_similarity
+    )
 
     return best_similarity
 
@@ -129,17 +157,13 @@ def filter_wikidata_results(original_term, wikidata_results, threshold):
     # Iterate through results to calculate similarity
     for result in wikidata_results:
 
-        logging.info(f"Original Term: {original_term}")
-        logging.info("Wikidata Response: %s", result["label"])
-
-        time.sleep(2)
+        logging.debug("Original Term: %s", original_term)
+        logging.debug("Wikidata Response: %s", result["label"])
 
         # For all labels and aliases for a single wikidata result, find the best similarity
-        similarity = best_single_record_similarity(original_term, result)
+        similarity = best_single_record_similarity(original_term, result, threshold)
 
-        logging.info(f"Similarity: {str(similarity)}")
-
-        time.sleep(2)
+        logging.debug("Similarity: %s", similarity)
 
         # If a record has a perfect similarity, there is no reason to use any other values
         if similarity == 100:
@@ -149,9 +173,7 @@ def filter_wikidata_results(original_term, wikidata_results, threshold):
         # Only consider matches that meet the threshold
         if similarity >= threshold and similarity > highest_similarity:
 
-            logging.info(f"Threshold passed, replacing {best_match} with " + result["label"])
-
-            time.sleep(2)
+            logging.debug("Threshold passed, replacing %s with %s", best_match, result["label"])
 
             # Store the best match and similarity if the threshold is passed
             best_match = result["label"]
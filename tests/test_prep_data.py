@@ -0,0 +1,43 @@
+# Import third-party libraries
+import pytest
+
+# Import native libraries
+import importlib.util
+import pathlib
+
+spacy = pytest.importorskip("spacy")
+
+# The scripts aren't a package, so load prep_data straight from its path
+spec = importlib.util.spec_from_file_location(
+    "prep_data",
+    pathlib.Path(__file__).parent.parent / "scripts" / "prep_data" / "prep_data.py"
+)
+prep_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(prep_data)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_filter_entries_keeps_every_occurrence(monkeypatch, processes):
+    """
+    Repeated texts only go through the NER model once, but every occurrence with entities is
+    still kept in its original order, including when spaCy runs across several processes.
+    """
+
+    # A blank pipeline that tags a single entity keeps the test independent of trained models
+    nlp = spacy.blank("en")
+    nlp.add_pipe("entity_ruler").add_patterns([{"label": "ORG", "pattern": "CIA"}])
+
+    monkeypatch.setattr(prep_data, "nlp", nlp)
+    monkeypatch.setattr(prep_data, "ner_batch_size", 4)
+    monkeypatch.setattr(prep_data, "ner_processes", processes)
+
+    # Evict verdicts quickly so repeats of texts still waiting on the model are covered too
+    monkeypatch.setattr(prep_data.Constants, "NER_CACHE_SIZE", 3)
+
+    words = " one two three four five six seven eight nine ten "
+    texts = [("CIA" if i % 3 else "cia") + words + str(i % 7) for i in range(100)]
+    texts += [None, "CIA is too short"]
+
+    expected = [text for text in texts if text and text.startswith("CIA") and "short" not in text]
+
+    assert list(prep_data.filter_entries(texts)) == expected